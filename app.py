@@ -3,18 +3,21 @@ Smart Learning App — Full (Phase A+B+C merged)
 File: smart_learning_app_full.py
 
 Run:
-    pip install streamlit pandas ics
+    pip install streamlit pandas numpy pyarrow
     streamlit run smart_learning_app_full.py
 """
 
 import streamlit as st
 import sqlite3
-from datetime import date, datetime, timedelta, time
+from datetime import date, datetime, timedelta, time, timezone
 import pandas as pd
+import numpy as np
 import math
 import io
 import os
-from ics import Calendar, Event
+import queue
+import threading
+from contextlib import contextmanager
 
 DB = "smart_learning_full.db"
 
@@ -28,15 +31,96 @@ def safe_rerun():
         except Exception:
             pass
 
-def db_connect():
-    return sqlite3.connect(DB)
+class SQLiteConnectionPool:
+    """
+    Small pool of long-lived SQLite connections.
+    Connections are opened lazily on first use (so init_db can still detect a fresh DB file)
+    and run in autocommit mode; callers that need a transaction issue BEGIN/COMMIT themselves.
+    """
+    def __init__(self, path, size=4):
+        self.path = path
+        self.size = size
+        self._pool = None
+        self._owned = set()  # connections belonging to the current (open) pool
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def _ensure_open(self):
+        with self._lock:
+            if self._pool is None:
+                pool = queue.Queue(maxsize=self.size)
+                for _ in range(self.size):
+                    conn = self._connect()
+                    self._owned.add(conn)
+                    pool.put(conn)
+                self._pool = pool
+            return self._pool
+
+    def acquire(self):
+        return self._ensure_open().get()
+
+    def release(self, conn):
+        with self._lock:
+            pool = self._pool if conn in self._owned else None
+        if pool is None:
+            # pool was closed (e.g. reset) while this connection was checked out; it may point
+            # at a deleted DB file, so never hand it to the current pool
+            conn.close()
+        else:
+            pool.put(conn)
+
+    @contextmanager
+    def get(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._owned = set()
+        if pool is None:
+            return
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+@st.cache_resource
+def get_pool():
+    # Streamlit re-executes the script on every interaction; keep one pool per server process
+    return SQLiteConnectionPool(DB)
+
+pool = get_pool()
 
 # ----------------- DB Init -----------------
 def init_db(seed_demo=True):
     new_db = not os.path.exists(DB)
-    conn = db_connect()
-    c = conn.cursor()
+    with pool.get() as conn:
+        c = conn.cursor()
+        _create_tables(c)
+        _create_version_triggers(c)
 
+    if new_db and seed_demo:
+        seed_demo_data()
+
+@st.cache_resource
+def ensure_db():
+    # schema setup only needs to run once per server process, not on every rerun;
+    # reset_all re-creates the schema itself
+    init_db(seed_demo=True)
+    return True
+
+def _create_tables(c):
     c.execute('''
         CREATE TABLE IF NOT EXISTS tasks (
             id INTEGER PRIMARY KEY,
@@ -83,11 +167,33 @@ def init_db(seed_demo=True):
             interval_days INTEGER
         )
     ''')
-    conn.commit()
-    conn.close()
-
-    if new_db and seed_demo:
-        seed_demo_data()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER DEFAULT 0
+        )
+    ''')
+    # indexes for the pending lookup, schedule/deadline date ranges, review lookup and sessions join.
+    # The range queries compare the stored ISO strings directly so these indexes can seek.
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_sched ON tasks(status, scheduled_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_sched ON tasks(scheduled_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_deadline ON tasks(deadline)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_subject_created ON tasks(subject, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_sessions_task ON sessions(task_id)')
+
+VERSIONED_TABLES = ('tasks', 'sessions', 'progress', 'quizzes')
+
+def _create_version_triggers(c):
+    # every write bumps table_versions.<table>, giving the st.cache_data wrappers a cheap cache key
+    for table in VERSIONED_TABLES:
+        for op in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{op.lower()} AFTER {op} ON {table}
+                BEGIN
+                    INSERT INTO table_versions (name, version) VALUES ('{table}', 1)
+                    ON CONFLICT(name) DO UPDATE SET version = version + 1;
+                END
+            ''')
 
 # ----------------- Seed demo data -----------------
 def seed_demo_data():
@@ -102,51 +208,91 @@ def seed_demo_data():
     add_quiz('Calculus - Limits & Continuity','Limit of sin(x)/x as x->0 equals?','1')
 
 # ----------------- DB helpers -----------------
+def table_version(name):
+    rows = run_query('SELECT version FROM table_versions WHERE name = ?', (name,), fetch=True)
+    return rows[0][0] if rows else 0
+
 def run_query(q, params=(), fetch=False):
-    conn = db_connect()
-    c = conn.cursor()
-    c.execute(q, params)
-    if fetch:
-        rows = c.fetchall()
-        conn.commit()
-        conn.close()
-        return rows
-    conn.commit()
-    conn.close()
+    # connections are pooled and in autocommit mode, so no explicit commit/close here.
+    # Non-fetch queries return the cursor's lastrowid: last_insert_rowid() is per-connection
+    # and a follow-up query may be served by a different pooled connection.
+    with pool.get() as conn:
+        c = conn.execute(q, params)
+        if fetch:
+            return c.fetchall()
+        return c.lastrowid
+
+@contextmanager
+def transaction():
+    # pooled connections autocommit each statement; group a batch of writes into one commit
+    with pool.get() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+def run_many(q, seq_of_params):
+    with transaction() as conn:
+        conn.executemany(q, seq_of_params)
 
 def add_task(subject, topic, minutes, difficulty, priority, deadline, status='pending', time_window='any'):
     if isinstance(deadline, (date, datetime)):
         dl = deadline.isoformat()
     else:
         dl = str(deadline)
-    run_query('INSERT INTO tasks (subject, topic, minutes, difficulty, priority, deadline, status, time_window) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+    return run_query('INSERT INTO tasks (subject, topic, minutes, difficulty, priority, deadline, status, time_window) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
               (subject, topic, minutes, difficulty, priority, dl, status, time_window))
 
-def fetch_tasks(where_clause="", params=()):
+def fetch_tasks(where_clause="", params=(), parse_dates=True):
     q = 'SELECT id,subject,topic,minutes,difficulty,priority,deadline,scheduled_date,time_window,status,created_at FROM tasks'
     if where_clause:
         q += ' WHERE ' + where_clause
     q += ' ORDER BY scheduled_date IS NULL, scheduled_date, deadline'
-    rows = run_query(q, params, fetch=True)
-    cols = ["id","subject","topic","minutes","difficulty","priority","deadline","scheduled_date","time_window","status","created_at"]
-    if not rows:
-        return pd.DataFrame(columns=cols)
-    return pd.DataFrame(rows, columns=cols)
-
-def update_task_schedule(task_id, scheduled_dt, time_window='any'):
-    run_query('UPDATE tasks SET scheduled_date = ?, status = ?, time_window = ? WHERE id = ?', (scheduled_dt.isoformat(), 'pending', time_window, task_id))
-
-def update_task_status(task_id, status):
-    run_query('UPDATE tasks SET status = ? WHERE id = ?', (status, task_id))
+    # read straight into an Arrow-backed frame with the date columns already parsed;
+    # parse_dates=False keeps the stored ISO text (e.g. for exports)
+    date_cols = ['deadline','scheduled_date','created_at'] if parse_dates else None
+    with pool.get() as conn:
+        return pd.read_sql_query(q, conn, params=params, dtype_backend='pyarrow', parse_dates=date_cols)
+
+@st.cache_resource(ttl=60, max_entries=16)
+def _cached_tasks(where_clause, params, version):
+    # cache_resource hands back the same frame without a pickle round-trip per rerun;
+    # fetch_tasks already returns Arrow-backed columns for st.table's Arrow serializer
+    return fetch_tasks(where_clause, params)
+
+def fetch_tasks_cached(where_clause="", params=()):
+    """
+    fetch_tasks for the schedule viewer and dashboard; reuses the last result until the tasks table changes.
+    The returned frame is shared between reruns and sessions, so callers must not modify it.
+    """
+    return _cached_tasks(where_clause, tuple(params), table_version('tasks'))
 
-def record_session(task_id, duration_minutes):
-    run_query('INSERT INTO sessions (task_id, duration_minutes, timestamp) VALUES (?, ?, ?)', (task_id, duration_minutes, datetime.now().isoformat()))
-    # adjust estimated minutes per-subject learning: simple moving average multiplier
-    # We'll compute multiplier when scheduling
+def apply_task_actions(done, missed):
+    """
+    Apply a batch of schedule-viewer actions in one transaction.
+    done: (task_id, topic, actual_minutes) tuples; missed: task ids.
+    """
+    now = datetime.now().isoformat()
+    with transaction() as conn:
+        conn.executemany('INSERT INTO sessions (task_id, duration_minutes, timestamp) VALUES (?, ?, ?)', [(tid, dur, now) for tid, _, dur in done])
+        conn.executemany('UPDATE tasks SET status = ? WHERE id = ?', [('done', tid) for tid, _, _ in done] + [('missed', tid) for tid in missed])
+        # update progress if there's a quiz topic matching
+        conn.executemany('INSERT INTO progress (topic, completed, last_score) VALUES (?, 1, ?) ON CONFLICT(topic) DO UPDATE SET completed = 1, last_score = excluded.last_score',
+                         [(topic, 0) for _, topic, _ in done])
 
 def add_quiz(topic, question, answer):
     run_query('INSERT INTO quizzes (topic, question, answer_text) VALUES (?, ?, ?)', (topic, question, answer))
 
+@st.cache_data(ttl=60)
+def _cached_quiz_topics(version):
+    return [r[0] for r in run_query('SELECT DISTINCT topic FROM quizzes', fetch=True)]
+
+def list_quiz_topics():
+    return _cached_quiz_topics(table_version('quizzes'))
+
 def fetch_quizzes_for_topic(topic):
     rows = run_query('SELECT id,topic,question,answer_text FROM quizzes WHERE topic = ?', (topic,), fetch=True)
     cols = ['id','topic','question','answer_text']
@@ -161,124 +307,171 @@ def mark_topic_completed(topic, score):
     else:
         run_query('INSERT INTO progress (topic, completed, last_score) VALUES (?, ?, ?)', (topic,1,score))
 
-def get_progress():
+@st.cache_data(ttl=60)
+def _cached_progress(version):
     rows = run_query('SELECT topic,completed,last_score FROM progress', fetch=True)
     return {r[0]: {'completed': r[1], 'last_score': r[2]} for r in rows}
 
+def get_progress():
+    return _cached_progress(table_version('progress'))
+
 # ----------------- Scheduling algorithm -----------------
-def smart_schedule(daily_minutes, review_intervals=[1,3,7], lookahead_days=60, time_preferences=None):
+class DayCapacity:
+    """
+    Max segment tree over the remaining minutes of each lookahead day.
+    roomiest_day(minutes, limit) returns the day in [0, limit) with the most room (earliest on ties)
+    in O(log D). Unlike a heap this answers any prefix, so tasks taken out of deadline order
+    still only see the days before their own deadline.
+    """
+    def __init__(self, capacities):
+        self.n = len(capacities)
+        self.size = 1
+        while self.size < self.n:
+            self.size *= 2
+        # nodes hold (remaining, -day) so max() prefers the earliest day on ties
+        self.tree = [(float('-inf'), 0)] * (2 * self.size)
+        for i, cap in enumerate(capacities):
+            self.tree[self.size + i] = (cap, -i)
+        for p in range(self.size - 1, 0, -1):
+            self.tree[p] = max(self.tree[2 * p], self.tree[2 * p + 1])
+
+    def take(self, day, minutes):
+        p = self.size + day
+        remaining, neg_day = self.tree[p]
+        self.tree[p] = (remaining - minutes, neg_day)
+        p //= 2
+        while p:
+            self.tree[p] = max(self.tree[2 * p], self.tree[2 * p + 1])
+            p //= 2
+
+    def roomiest_day(self, minutes_needed, limit=None):
+        """Index of the roomiest day before `limit` (default: all days), or None if it can't fit minutes_needed."""
+        if limit is None:
+            limit = self.n
+        lo, hi = self.size, self.size + max(0, min(limit, self.n))
+        best = (float('-inf'), 0)
+        while lo < hi:
+            if lo & 1:
+                best = max(best, self.tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                best = max(best, self.tree[hi])
+            lo //= 2
+            hi //= 2
+        remaining, neg_day = best
+        return -neg_day if remaining >= minutes_needed else None
+
+def smart_schedule(daily_minutes, review_intervals=[1,3,7], lookahead_days=60, time_preferences=None, buffer_minutes=0):
     """
-    - schedules unscheduled pending tasks into days up to daily_minutes
-    - prioritizes deadline -> priority -> difficulty
+    - schedules unscheduled pending tasks into days up to daily_minutes - buffer_minutes
+      (returns 0 without scheduling anything if the buffer leaves no capacity)
+    - orders by least slack (days until deadline minus days of work needed) -> priority -> difficulty,
+      so large tasks aren't squeezed against their deadline by small ones due the same day
     - tries to respect time_window and time_preferences where possible
     - creates review tasks for first scheduled occurrence
     """
     if time_preferences is None:
         time_preferences = {'morning':1.0,'afternoon':1.0,'evening':1.0,'any':1.0}
 
+    # keep buffer_minutes free each day as slack for overruns
+    capacity = max(0, daily_minutes - buffer_minutes)
+    if capacity == 0:
+        return 0
+
     today = date.today()
-    pending = fetch_tasks("status = 'pending' AND scheduled_date IS NULL")
-    if pending.empty:
+    pending = run_query("SELECT id,subject,minutes,difficulty,priority,deadline,time_window FROM tasks WHERE status = 'pending' AND scheduled_date IS NULL ORDER BY id", fetch=True)
+    if not pending:
         return 0
 
     # read sessions to compute subject-speed multipliers
     speed = compute_subject_speed()  # dict subject -> multiplier (<=1 faster, >1 slower)
-    pending['deadline_date'] = pd.to_datetime(pending['deadline']).dt.date
-    pending = pending.sort_values(by=['deadline_date','priority','difficulty'], ascending=[True, False, False])
-
-    schedule_days = [today + timedelta(days=i) for i in range(lookahead_days)]
-    day_capacity = {d.isoformat(): daily_minutes for d in schedule_days}
-    scheduled_count = 0
-    first_scheduled_for_topic = {}
-
-    for _, row in pending.iterrows():
-        tid = int(row['id'])
-        original_minutes = int(row['minutes'])
-        subject = row['subject']
-        minutes_needed = max(5, int(original_minutes * speed.get(subject, 1.0)))
-        preferred_window = row['time_window'] or 'any'
-        deadline = row['deadline_date']
-
-        # candidates: prefer before deadline
-        candidates = [d for d in schedule_days if d <= deadline] or schedule_days
-
-        placed = False
-        # try prefer days matching time window and user's preference
-        # we'll attempt candidates in order but prefer days where time preference weight is higher
-        for d in candidates:
-            key = d.isoformat()
-            # check capacity and (optionally) window match
-            if day_capacity[key] >= minutes_needed:
-                # simple time_window handling: prefer days that are available; we don't schedule time-of-day slots strictly here
-                update_task_schedule(tid, datetime.combine(d, datetime.min.time()), time_window=preferred_window)
-                day_capacity[key] -= minutes_needed
-                scheduled_count += 1
-                if subject not in first_scheduled_for_topic:
-                    first_scheduled_for_topic[subject] = d
-                placed = True
-                break
+    # speed-adjusted estimates for every task at once: one multiplier per row, at least 5 minutes
+    mult = np.array([speed.get(r[1], 1.0) for r in pending])
+    minutes_needed = np.maximum(5, (np.array([r[2] for r in pending]) * mult).astype(int))
+    # deadlines as whole-day offsets from today, parsed once by numpy; day i of the lookahead
+    # is before task k's deadline exactly when i <= deadline_offsets[k]
+    deadline_offsets = (np.array([r[5][:10] for r in pending], dtype='datetime64[D]') - np.datetime64(today, 'D')).astype(int)
+    slack = deadline_offsets - minutes_needed / capacity
+    # slack asc, then priority desc, then difficulty desc (lexsort's last key is the primary one)
+    order = np.lexsort((
+        -np.array([r[3] for r in pending]),
+        -np.array([r[4] for r in pending]),
+        slack,
+    ))
+
+    # day index -> date strings, built once; one extra day covers reviews landing on the lookahead edge
+    horizon = [today + timedelta(days=i) for i in range(lookahead_days + 1)]
+    day_iso = [d.isoformat() for d in horizon]
+    day_dt_iso = [datetime.combine(d, time.min).isoformat() for d in horizon]
+    days = DayCapacity([capacity] * lookahead_days)
+    placements = []  # (scheduled_date, status, time_window, id) rows for one batched UPDATE
+    first_scheduled_for_topic = {}  # subject -> day index
+
+    for k in order:
+        tid, subject, _, _, _, _, preferred_window = pending[k]
+        preferred_window = preferred_window or 'any'
+
+        # prefer the emptiest day before the deadline, otherwise the emptiest day in the lookahead
+        i = days.roomiest_day(minutes_needed[k], limit=int(deadline_offsets[k]) + 1)
+        if i is None:
+            i = days.roomiest_day(minutes_needed[k])
+        if i is None:
+            # leave unscheduled
+            continue
+
+        placements.append((day_dt_iso[i], 'pending', preferred_window, tid))
+        days.take(i, minutes_needed[k])
+        if subject not in first_scheduled_for_topic:
+            first_scheduled_for_topic[subject] = i
 
-        if not placed:
-            # try full lookahead without deadline restriction
-            for d in schedule_days:
-                key = d.isoformat()
-                if day_capacity[key] >= minutes_needed:
-                    update_task_schedule(tid, datetime.combine(d, datetime.min.time()), time_window=preferred_window)
-                    day_capacity[key] -= minutes_needed
-                    scheduled_count += 1
-                    if subject not in first_scheduled_for_topic:
-                        first_scheduled_for_topic[subject] = d
-                    placed = True
-                    break
-        # if still not placed, leave unscheduled
-
-    # create review tasks
-    for subject, first_date in first_scheduled_for_topic.items():
+    # plan review tasks
+    reviews = []
+    for subject, first_day in first_scheduled_for_topic.items():
         # find first task for subject
         rows = run_query('SELECT id,topic,minutes FROM tasks WHERE subject = ? ORDER BY created_at LIMIT 1', (subject,), fetch=True)
         if not rows:
             continue
         original_id, topic, minutes = rows[0]
         for offset in review_intervals:
-            review_date = first_date + timedelta(days=offset)
-            if review_date <= today + timedelta(days=lookahead_days):
+            review_day = first_day + offset
+            if review_day <= lookahead_days:
                 review_minutes = max(10, math.ceil(minutes * 0.25))
-                add_task(subject + ' (review)', topic + ' - review', review_minutes, 1, 3, review_date, status='review')
-                last = run_query('SELECT last_insert_rowid()', fetch=True)
-                try:
-                    review_id = last[0][0]
-                    run_query('INSERT INTO reviews (original_task_id, review_task_id, interval_days) VALUES (?, ?, ?)', (original_id, review_id, offset))
-                    update_task_schedule(review_id, datetime.combine(review_date, datetime.min.time()))
-                except Exception:
-                    pass
-
-    return scheduled_count
+                reviews.append((original_id, offset, subject + ' (review)', topic + ' - review', review_minutes, review_day))
+
+    # write placements and reviews in a single transaction
+    with transaction() as conn:
+        conn.executemany('UPDATE tasks SET scheduled_date = ?, status = ?, time_window = ? WHERE id = ?', placements)
+        review_links = []
+        for original_id, offset, review_subject, review_topic, review_minutes, review_day in reviews:
+            # review tasks are inserted already scheduled on their review date
+            review_id = conn.execute('INSERT INTO tasks (subject, topic, minutes, difficulty, priority, deadline, scheduled_date, status, time_window) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id',
+                                     (review_subject, review_topic, review_minutes, 1, 3, day_iso[review_day],
+                                      day_dt_iso[review_day], 'pending', 'any')).fetchone()[0]
+            review_links.append((original_id, review_id, offset))
+        conn.executemany('INSERT INTO reviews (original_task_id, review_task_id, interval_days) VALUES (?, ?, ?)', review_links)
+
+    return len(placements)
 
 # ----------------- Missed rescheduler -----------------
 def reschedule_missed(daily_minutes, lookahead_days=60):
     today = date.today()
+    # candidate days start tomorrow; used[i] is the minutes already booked on candidate_days[i]
+    candidate_days = [today + timedelta(days=offset) for offset in range(1, lookahead_days+1)]
     scheduled = fetch_tasks("scheduled_date IS NOT NULL")
-    used = { (today + timedelta(days=i)).isoformat(): 0 for i in range(lookahead_days) }
-    for _, r in scheduled.iterrows():
-        if pd.isna(r['scheduled_date']):
+    scheduled['day'] = scheduled['scheduled_date'].dt.date
+    used = scheduled.groupby('day')['minutes'].sum().reindex(candidate_days, fill_value=0).to_numpy(dtype=int, copy=True)
+    missed = run_query("SELECT id,minutes FROM tasks WHERE status = 'missed' ORDER BY scheduled_date IS NULL, scheduled_date, deadline", fetch=True)
+    updates = []
+    for tid, mins in missed:
+        fits = used + mins <= daily_minutes
+        i = int(np.argmax(fits))  # first day that fits (0 if none does, hence the check below)
+        if not fits[i]:
             continue
-        d = pd.to_datetime(r['scheduled_date']).date().isoformat()
-        if d in used:
-            used[d] += int(r['minutes'])
-    missed = fetch_tasks("status = 'missed'")
-    rescheduled = 0
-    for _, r in missed.iterrows():
-        tid = int(r['id'])
-        mins = int(r['minutes'])
-        for offset in range(1, lookahead_days+1):
-            cand = (today + timedelta(days=offset)).isoformat()
-            if used.get(cand, 0) + mins <= daily_minutes:
-                update_task_schedule(tid, datetime.combine(datetime.fromisoformat(cand).date(), datetime.min.time()))
-                used[cand] = used.get(cand, 0) + mins
-                run_query('UPDATE tasks SET status = ? WHERE id = ?', ('pending', tid))
-                rescheduled += 1
-                break
-    return rescheduled
+        used[i] += mins
+        updates.append((datetime.combine(candidate_days[i], datetime.min.time()).isoformat(), 'pending', 'any', tid))
+    run_many('UPDATE tasks SET scheduled_date = ?, status = ?, time_window = ? WHERE id = ?', updates)
+    return len(updates)
 
 # ----------------- Learning pattern helpers -----------------
 def compute_subject_speed():
@@ -287,17 +480,20 @@ def compute_subject_speed():
     We return multiplier such that multiplier < 1 means user is faster -> reduce future estimates.
     If no data, return 1.0
     """
-    rows = run_query('''SELECT t.subject, t.minutes, s.duration_minutes
-                        FROM sessions s JOIN tasks t ON s.task_id = t.id''', fetch=True)
-    if not rows:
-        return {}
-    df = pd.DataFrame(rows, columns=['subject','estimated','actual'])
-    grouped = df.groupby('subject').agg({'estimated':'mean','actual':'mean'}).reset_index()
+    # keyed on sessions only: task estimates are never edited after insert
+    return _cached_subject_speed(table_version('sessions'))
+
+@st.cache_data(ttl=60)
+def _cached_subject_speed(version):
+    rows = run_query('''SELECT t.subject, AVG(t.minutes), AVG(s.duration_minutes)
+                        FROM sessions s JOIN tasks t ON s.task_id = t.id
+                        GROUP BY t.subject''', fetch=True)
     multipliers = {}
-    for _, r in grouped.iterrows():
-        est = r['estimated'] if r['estimated']>0 else 1
-        actual = r['actual'] if r['actual']>0 else est
-        multipliers[r['subject']] = actual / est
+    for subject, est, actual in rows:
+        # AVG is NULL when every value in the group is NULL
+        est = est if est and est > 0 else 1
+        actual = actual if actual and actual > 0 else est
+        multipliers[subject] = actual / est
     # clamp multipliers to [0.6, 1.6] to avoid extremes
     for k in multipliers:
         multipliers[k] = max(0.6, min(1.6, multipliers[k]))
@@ -305,30 +501,75 @@ def compute_subject_speed():
 
 # ----------------- Analytics -----------------
 def compute_stats():
-    tasks = fetch_tasks()
-    total = len(tasks)
-    done = len(tasks[tasks['status']=='done'])
-    missed = len(tasks[tasks['status']=='missed'])
-    pending = len(tasks[tasks['status']=='pending'])
-    rows = run_query('SELECT task_id, duration_minutes FROM sessions', fetch=True)
-    time_spent = {}
-    for task_id, dur in rows:
-        t = run_query('SELECT subject FROM tasks WHERE id = ?', (task_id,), fetch=True)
-        if t:
-            subject = t[0][0]
-            time_spent[subject] = time_spent.get(subject, 0) + dur
+    counts = dict(run_query('SELECT status, COUNT(*) FROM tasks GROUP BY status', fetch=True))
+    total = sum(counts.values())
+    done = counts.get('done', 0)
+    missed = counts.get('missed', 0)
+    pending = counts.get('pending', 0)
+    rows = run_query('''SELECT t.subject, SUM(s.duration_minutes)
+                        FROM sessions s JOIN tasks t ON s.task_id = t.id
+                        GROUP BY t.subject''', fetch=True)
+    time_spent = dict(rows)
     progress = get_progress()
     return {'total': total, 'done': done, 'missed': missed, 'pending': pending, 'time_spent': time_spent, 'progress_map': progress}
 
+# ----------------- Export -----------------
+def _ics_escape(text):
+    return str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def _ics_line(name, value):
+    # RFC 5545 3.1: fold lines longer than 75 octets, continuation lines start with a space
+    line = f"{name}:{value}"
+    if len(line.encode('utf-8')) <= 75:
+        return line + '\r\n'
+    parts, cur, size = [], '', 0
+    for ch in line:
+        n = len(ch.encode('utf-8'))
+        if size + n > 75:
+            parts.append(cur)
+            cur, size = ' ', 1
+        cur += ch
+        size += n
+    parts.append(cur)
+    return '\r\n'.join(parts) + '\r\n'
+
+def build_ics(rows):
+    """
+    Serialize scheduled task rows (as returned by fetch_tasks) to UTF-8 iCalendar bytes.
+    Written directly instead of through the ics package, one VEVENT per task.
+    """
+    starts = rows['scheduled_date'].dt.strftime('%Y%m%dT%H%M%SZ')
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    # encode as we go so the payload exists only once, as bytes; newline='' keeps the CRLFs as written
+    buf = io.BytesIO()
+    out = io.TextIOWrapper(buf, encoding='utf-8', newline='')
+    out.write('BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Smart Learning App//EN\r\n')
+    for r, dtstart in zip(rows.itertuples(index=False), starts):
+        out.write('BEGIN:VEVENT\r\n')
+        out.write(f'UID:task-{r.id}@smart-learning\r\nDTSTAMP:{stamp}\r\nDTSTART:{dtstart}\r\nDURATION:PT{int(r.minutes)}M\r\n')
+        out.write(_ics_line('SUMMARY', _ics_escape(f"{r.subject} — {r.topic}")))
+        out.write(_ics_line('DESCRIPTION', _ics_escape(f"Status: {r.status} | Diff: {r.difficulty} | Prio: {r.priority}")))
+        out.write('END:VEVENT\r\n')
+    out.write('END:VCALENDAR\r\n')
+    out.flush()
+    data = buf.getvalue()
+    out.detach()
+    return data
+
 # ----------------- Reset -----------------
 def reset_all():
-    if os.path.exists(DB):
-        os.remove(DB)
+    pool.close_all()
+    for path in (DB, DB + '-wal', DB + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    # table versions restart from zero in the new DB, so cached results could match stale keys
+    st.cache_data.clear()
+    _cached_tasks.clear()
     init_db(seed_demo=False)
 
 # ----------------- UI -----------------
 st.set_page_config(page_title="Smart Learning App", layout="wide")
-init_db(seed_demo=True)
+ensure_db()
 
 st.title("📚 Smart Learning App — Adaptive Scheduler & Coach")
 
@@ -361,8 +602,10 @@ daily_hours = st.sidebar.number_input("Available study hours / day", min_value=0
 daily_minutes = int(daily_hours * 60)
 review_intervals = st.sidebar.multiselect("Spaced repetition intervals (days)", options=[1,2,3,5,7,14], default=[1,3,7])
 lookahead = st.sidebar.number_input("Lookahead days", min_value=7, max_value=180, value=60)
+# leave at least 5 minutes (the shortest schedulable task) of daily capacity
+buffer_minutes = st.sidebar.number_input("Buffer minutes / day (kept free)", min_value=0, max_value=min(120, daily_minutes - 5), value=0, step=5)
 if st.sidebar.button("Auto-generate schedule"):
-    n = smart_schedule(daily_minutes, review_intervals, lookahead_days=int(lookahead))
+    n = smart_schedule(daily_minutes, review_intervals, lookahead_days=int(lookahead), buffer_minutes=int(buffer_minutes))
     st.sidebar.success(f"Scheduled {n} tasks.")
 if st.sidebar.button("Reschedule missed tasks"):
     r = reschedule_missed(daily_minutes, lookahead_days=int(lookahead))
@@ -370,69 +613,63 @@ if st.sidebar.button("Reschedule missed tasks"):
 
 st.sidebar.markdown("---")
 if st.sidebar.button("Export CSV"):
-    rows = fetch_tasks()
-    csv = rows.to_csv(index=False)
-    st.sidebar.download_button("Download tasks.csv", data=csv, file_name="tasks.csv", mime="text/csv")
+    rows = fetch_tasks(parse_dates=False)
+    buf = io.BytesIO()
+    rows.to_csv(buf, index=False)  # written as UTF-8 bytes, no intermediate str
+    st.sidebar.download_button("Download tasks.csv", data=buf.getvalue(), file_name="tasks.csv", mime="text/csv")
 if st.sidebar.button("Export .ics Calendar"):
     rows = fetch_tasks("scheduled_date IS NOT NULL")
-    cal = Calendar()
-    for _, r in rows.iterrows():
-        if pd.isna(r['scheduled_date']):
-            continue
-        e = Event()
-        start_dt = pd.to_datetime(r['scheduled_date'])
-        e.name = f"{r['subject']} — {r['topic']}"
-        e.begin = start_dt.isoformat()
-        e.duration = timedelta(minutes=int(r['minutes']))
-        e.description = f"Status: {r['status']} | Diff: {r['difficulty']} | Prio: {r['priority']}"
-        cal.events.add(e)
-    f = io.StringIO(str(cal))
-    st.sidebar.download_button("Download calendar.ics", data=f.getvalue(), file_name="study_schedule.ics", mime="text/calendar")
+    st.sidebar.download_button("Download calendar.ics", data=build_ics(rows), file_name="study_schedule.ics", mime="text/calendar")
 
 # Main area: schedule viewer
 st.header("🗓 Schedule")
 start = st.date_input("View start date", value=date.today())
 days = st.slider("Days to show", min_value=3, max_value=90, value=14)
 end = start + timedelta(days=days-1)
-rows = fetch_tasks('scheduled_date IS NOT NULL AND date(scheduled_date) BETWEEN date(?) AND date(?)', (start.isoformat(), end.isoformat()))
+# half-open ISO-string range on the raw column so idx_tasks_sched can serve it
+rows = fetch_tasks_cached('scheduled_date >= ? AND scheduled_date < ?', (start.isoformat(), (end + timedelta(days=1)).isoformat()))
 if rows.empty:
     st.info("No scheduled tasks in this range. Use Auto-generate schedule or add tasks.")
 else:
-    rows['scheduled_day'] = pd.to_datetime(rows['scheduled_date']).dt.date
-    for d in pd.date_range(start, end):
-        dstr = d.date().isoformat()
-        day_rows = rows[rows['scheduled_day'] == d.date()]
-        st.subheader(dstr + f" — {len(day_rows)} item(s)")
-        if day_rows.empty:
+    # split into per-day frames in one pass (grouping key kept off the cached frame)
+    by_day = dict(tuple(rows.groupby(rows['scheduled_date'].dt.date, sort=False)))
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        dstr = day.isoformat()
+        day_rows = by_day.get(day)
+        if day_rows is None:
+            st.subheader(dstr + " — 0 item(s)")
             st.write("No tasks")
             continue
+        st.subheader(dstr + f" — {len(day_rows)} item(s)")
         df_display = day_rows[['id','subject','topic','minutes','difficulty','priority','time_window','status']]
         st.table(df_display)
-        for idx, r in day_rows.iterrows():
-            cols = st.columns([4,1,1,1])
-            cols[0].write(f"**{r['subject']}** — {r['topic']} ({r['minutes']} min) — window: {r['time_window']} — status: {r['status']}")
-            if cols[1].button("Done", key=f"done_{int(r['id'])}"):
-                # ask for actual duration optionally
-                dur = st.number_input(f"Actual minutes spent on {r['topic']}", min_value=1, value=int(r['minutes']), key=f"dur_{int(r['id'])}")
-                record_session(int(r['id']), int(dur))
-                update_task_status(int(r['id']), 'done')
-                # update progress if there's a quiz topic matching
-                mark_topic_completed(r['topic'], 0)
-                safe_rerun()
-            if cols[2].button("Missed", key=f"missed_{int(r['id'])}"):
-                update_task_status(int(r['id']), 'missed')
-                safe_rerun()
-            if cols[3].button("Reschedule", key=f"resch_{int(r['id'])}"):
-                # simple reschedule to next day with capacity
-                reschedule_missed(daily_minutes, lookahead_days=14)
+        # one form per day: choices are collected and applied together on a single rerun.
+        # clear_on_submit resets the radios, so a later Apply doesn't replay earlier choices
+        with st.form(f"day_{dstr}", clear_on_submit=True):
+            choices = []
+            for idx, r in day_rows.iterrows():
+                tid = int(r['id'])
+                cols = st.columns([4,2,1])
+                cols[0].write(f"**{r['subject']}** — {r['topic']} ({r['minutes']} min) — window: {r['time_window']} — status: {r['status']}")
+                action = cols[1].radio("Action", options=['—','Done','Missed','Reschedule'], horizontal=True, key=f"action_{tid}", label_visibility="collapsed")
+                dur = cols[2].number_input("Actual minutes", min_value=1, value=int(r['minutes']), key=f"dur_{tid}")
+                choices.append((tid, r['topic'], r['status'], action, int(dur)))
+            if st.form_submit_button("Apply"):
+                # ignore choices that match the row's current status (no duplicate sessions)
+                done = [(tid, topic, dur) for tid, topic, status, action, dur in choices if action == 'Done' and status != 'done']
+                missed = [tid for tid, _, status, action, _ in choices if (action == 'Missed' and status != 'missed') or action == 'Reschedule']
+                apply_task_actions(done, missed)
+                if any(action == 'Reschedule' for _, _, _, action, _ in choices):
+                    # simple reschedule to next day with capacity
+                    reschedule_missed(daily_minutes, lookahead_days=14)
                 safe_rerun()
 
 # Quizzes & progress area
 st.markdown("---")
 st.header("🧠 Quizzes & Progress")
 progress_map = get_progress()
-all_quiz_topics = [r[0] for r in run_query('SELECT DISTINCT topic FROM quizzes', fetch=True)]  # list of tuples -> pick first
-all_quiz_topics = [t[0] for t in run_query('SELECT DISTINCT topic FROM quizzes', fetch=True)] if run_query('SELECT DISTINCT topic FROM quizzes', fetch=True) else []
+all_quiz_topics = list_quiz_topics()
 # fallback if no quizzes in DB
 if not all_quiz_topics:
     all_quiz_topics = ["Generators and Iterators","Calculus - Limits & Continuity"]
@@ -476,11 +713,12 @@ else:
     st.write("No sessions recorded yet.")
 
 st.subheader("Upcoming deadlines (30 days)")
-upcoming = fetch_tasks("date(deadline) BETWEEN date(?) AND date(?)", (date.today().isoformat(), (date.today()+timedelta(days=30)).isoformat()))
+upcoming = fetch_tasks_cached("deadline >= ? AND deadline < ?", (date.today().isoformat(), (date.today()+timedelta(days=31)).isoformat()))
 if upcoming.empty:
     st.write("No upcoming deadlines within 30 days.")
 else:
-    st.table(upcoming[['subject','topic','deadline','status']])
+    # show plain dates; assign() copies, leaving the cached frame untouched
+    st.table(upcoming[['subject','topic','deadline','status']].assign(deadline=upcoming['deadline'].dt.date))
 
 # Suggestions (simple)
 st.markdown("---")